@@ -11,8 +11,44 @@
 """
 
 import pandas as pd
+from pyexcelerate import Workbook
 import sys
 import os
+import re
+import argparse
+from functools import lru_cache
+
+# Алфавиты для сдвига: набор пар (первая буква, количество букв)
+ALPHABETS = {
+    'ru': (('А', 32), ('а', 32)),     # русские буквы без 'ё'
+    'en': (('A', 26), ('a', 26)),     # английские буквы
+    'en_lower': (('a', 26),),         # только строчные английские
+}
+
+# Ключ - последняя буква перед номером квартиры (между двумя последними точками)
+DOT_KEY_RE = re.compile(r'\.[^.]*?([^\W\d_])\s*\.[^.]*$')
+# Запасной вариант - русская буква перед цифрами
+KEY_RE = re.compile(r'([а-яА-ЯёЁ])[.\s]+(?:\d+)')
+
+# Кэш таблиц: таблица для каждой пары (смещение, алфавит) строится один раз.
+# Ключом может быть строчная или заглавная русская буква (включая ё/Ё) -
+# это около 66 смещений, по 3 алфавита на каждое
+SHIFT_TABLE_CACHE_SIZE = 256
+
+@lru_cache(maxsize=SHIFT_TABLE_CACHE_SIZE)
+def get_shift_table(shift, alphabet_id):
+    """
+    Таблица перевода для str.translate: каждая буква алфавита
+    сдвигается на shift позиций назад с циклическим переходом
+    """
+    source = ""
+    target = ""
+    for first_char, size in ALPHABETS[alphabet_id]:
+        letters = "".join(chr(ord(first_char) + i) for i in range(size))
+        offset = -shift % size
+        source += letters
+        target += letters[offset:] + letters[:offset]
+    return str.maketrans(source, target)
 
 def decrypt_address(address, key_char):
     """
@@ -22,31 +58,8 @@ def decrypt_address(address, key_char):
     # Вычисляем смещение
     shift = ord(key_char) - ord('в')
     
-    decrypted = ""
-    for char in address:
-        # Заглавные русские буквы
-        if 'А' <= char <= 'Я':
-            new_pos = ord(char) - shift
-            if ord('А') <= new_pos <= ord('Я'):
-                decrypted += chr(new_pos)
-            elif new_pos < ord('А'):
-                decrypted += chr(ord('Я') - (ord('А') - new_pos) + 1)
-            else:  # new_pos > ord('Я')
-                decrypted += chr(ord('А') + (new_pos - ord('Я')) - 1)
-        
-        # Строчные русские буквы
-        elif 'а' <= char <= 'я':
-            new_pos = ord(char) - shift
-            if ord('а') <= new_pos <= ord('я'):
-                decrypted += chr(new_pos)
-            elif new_pos < ord('а'):
-                decrypted += chr(ord('я') - (ord('а') - new_pos) + 1)
-            else:  # new_pos > ord('я')
-                decrypted += chr(ord('а') + (new_pos - ord('я')) - 1)
-        
-        # Остальные символы оставляем без изменений
-        else:
-            decrypted += char
+    # Сдвигаются русские буквы, остальные символы остаются без изменений
+    decrypted = address.translate(get_shift_table(shift, 'ru'))
     
     return decrypted, -shift  # минус для отображения как в вашем коде
 
@@ -54,80 +67,161 @@ def decrypt_email(email, shift):
     """
     Расшифровка email с заданным смещением
     """
-    decrypted = ""
-    for char in email:
-        # Заглавные английские буквы
-        if 'A' <= char <= 'Z':
-            new_pos = ord(char) - shift
-            if ord('A') <= new_pos <= ord('Z'):
-                decrypted += chr(new_pos)
-            elif new_pos < ord('A'):
-                decrypted += chr(ord('Z') - (ord('A') - new_pos) + 1)
-            else:  # new_pos > ord('Z')
-                decrypted += chr(ord('A') + (new_pos - ord('Z')) - 1)
-        
-        # Строчные английские буквы
-        elif 'a' <= char <= 'z':
-            new_pos = ord(char) - shift
-            if ord('a') <= new_pos <= ord('z'):
-                decrypted += chr(new_pos)
-            elif new_pos < ord('a'):
-                decrypted += chr(ord('z') - (ord('a') - new_pos) + 1)
-            else:  # new_pos > ord('z')
-                decrypted += chr(ord('a') + (new_pos - ord('z')) - 1)
-        
-        # Остальные символы (цифры, @, ., и т.д.)
-        else:
-            decrypted += char
-    
-    return decrypted
+    # Сдвигаются английские буквы, остальные символы (цифры, @, ., и т.д.) не меняются
+    return email.translate(get_shift_table(shift, 'en'))
 
 def decrypt_phone(phone, shift):
     """
     Расшифровка телефона с заданным смещением.
     Смещаются только строчные английские буквы.
     """
-    decrypted = ""
-    for char in str(phone):
-        # Только строчные английские буквы
-        if 'a' <= char <= 'z':
-            new_pos = ord(char) - shift
-            if ord('a') <= new_pos <= ord('z'):
-                decrypted += chr(new_pos)
-            elif new_pos < ord('a'):
-                decrypted += chr(ord('z') - (ord('a') - new_pos) + 1)
-            else:  # new_pos > ord('z')
-                decrypted += chr(ord('a') + (new_pos - ord('z')) - 1)
-        else:
-            decrypted += char
-    
-    return decrypted
+    return str(phone).translate(get_shift_table(shift, 'en_lower'))
 
 def extract_key_from_address(address):
     """
     Извлекает ключевую букву из адреса
     """
     # Берем последнюю букву перед номером квартиры
-    parts = address.split('.')
-    if len(parts) >= 3:
-        key_part = parts[-2].strip()
+    rest, _, _ = address.rpartition('.')
+    _, dot, key_part = rest.rpartition('.')
+    if dot:
+        key_part = key_part.strip()
         if key_part and key_part[-1].isalpha():
             return key_part[-1]
     
     # Если не нашли через точки, ищем по паттерну с цифрами
-    import re
-    match = re.search(r'([а-яА-ЯёЁ])[.\s]+(?:\d+)', address)
+    match = KEY_RE.search(address)
     if match:
         return match.group(1)
     
     return None
 
+def extract_keys(addresses):
+    """
+    Извлекает ключевые буквы сразу из столбца адресов
+    (то же, что extract_key_from_address, но без цикла по строкам)
+    Для адресов без ключа возвращает NaN
+    """
+    # Берем последнюю букву перед номером квартиры
+    keys = addresses.str.extract(DOT_KEY_RE, expand=False)
+    # [^\W\d_] пропускает и цифровые символы-не-буквы ('½', '²'),
+    # поэтому, как и в extract_key_from_address, оставляем только буквы
+    keys = keys.where(keys.str.isalpha().fillna(False).astype(bool))
+    
+    # Если не нашли через точки, ищем по паттерну с цифрами
+    found = addresses.str.extract(KEY_RE, expand=False)
+    return keys.fillna(found)
+
+def column_as_str(data, position):
+    """
+    Возвращает столбец с заданным номером в виде строк
+    """
+    if data.shape[1] > position:
+        return data.iloc[:, position].astype(str)
+    return pd.Series("", index=data.index)
+
+def decrypt_dataframe(data, verbose=False):
+    """
+    Расшифровка всех строк таблицы по столбцам, без цикла по строкам
+    При verbose=True выводит расшифровку каждой строки
+    Возвращает датасет с результатами
+    """
+    # Получаем данные из колонок (индексы могут отличаться)
+    # В вашем файле: Unnamed: 1 - телефон, Unnamed: 2 - email, Unnamed: 3 - адрес
+    phones = column_as_str(data, 1)
+    emails = column_as_str(data, 2)
+    addresses = column_as_str(data, 3)
+    
+    has_address = addresses.notna() & ~addresses.isin(['', 'nan'])
+    for idx in data.index[~has_address]:
+        print(f"Строка {idx+1}: пустой адрес, пропускаем")
+    
+    # Извлекаем ключевые буквы из адресов
+    keys = extract_keys(addresses[has_address])
+    for idx in keys.index[keys.isna()]:
+        print(f"Строка {idx+1}: не удалось извлечь ключ из адреса: {addresses[idx][:50]}...")
+    keys = keys.dropna()
+    
+    # Вычисляем смещение относительно буквы 'в'
+    shifts = keys.map(ord) - ord('в')
+    
+    decrypted_addresses = pd.Series(index=keys.index, dtype=object)
+    decrypted_emails = pd.Series(index=keys.index, dtype=object)
+    decrypted_phones = pd.Series(index=keys.index, dtype=object)
+    
+    # Строки с одинаковым смещением расшифровываются одной таблицей перевода
+    for shift, idx in shifts.groupby(shifts).groups.items():
+        shift = int(shift)
+        decrypted_addresses[idx] = addresses[idx].str.translate(get_shift_table(shift, 'ru'))
+        decrypted_emails[idx] = emails[idx].str.translate(get_shift_table(shift, 'en'))
+        decrypted_phones[idx] = phones[idx].str.translate(get_shift_table(shift, 'en_lower'))
+    
+    # Создаем датасет с результатами
+    result_df = pd.DataFrame({
+        'Телефон (расшифрованный)': decrypted_phones,
+        'Email (расшифрованный)': decrypted_emails,
+        'Адрес (расшифрованный)': decrypted_addresses,
+        'Ключ шифрования (буква → смещение)': keys + ' -> ' + shifts.astype(str),
+        'Смещение': shifts
+    })
+    
+    # Подробный вывод - до сброса индекса, чтобы номера строк совпадали с входным файлом
+    if verbose:
+        print_details(result_df, keys)
+    
+    return result_df.reset_index(drop=True)
+
+def print_details(result_df, keys):
+    """
+    Выводит расшифровку каждой строки (номера строк - по индексу result_df)
+    Текст собирается целиком и выводится одним вызовом print
+    """
+    lines = []
+    for (idx, phone, email, address, _, shift), key_char in zip(result_df.itertuples(), keys):
+        lines.append(f"\nСтрока {idx+1}:")
+        lines.append(f"  Ключ: '{key_char}' -> смещение {shift}")
+        lines.append(f"  Адрес: {address}")
+        lines.append(f"  Email: {email}")
+        lines.append(f"  Телефон: {phone}")
+    print("\n".join(lines))
+
+def save_to_excel(result_df, output_file):
+    """
+    Сохраняет датасет в Excel-файл через pyexcelerate
+    (пишет только значения, заметно быстрее и экономнее по памяти, чем to_excel)
+    """
+    # Пустые ячейки передаем как None, числа - как обычные int
+    values = result_df.astype(object).where(result_df.notna(), None)
+    rows = [list(result_df.columns)]
+    rows += zip(*(values[column].tolist() for column in values.columns))
+    
+    workbook = Workbook()
+    workbook.new_sheet("Sheet1", data=rows)
+    workbook.save(output_file)
+
 def main():
     """
     Основная функция программы
     """
+    parser = argparse.ArgumentParser(
+        description="Деобезличивание данных из Excel-файла"
+    )
+    parser.add_argument(
+        "file_path",
+        nargs="?",
+        help="Путь к Excel-файлу (если не указан, будет запрошен)"
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Выводить расшифровку каждой строки (для больших файлов заметно медленнее)"
+    )
+    args = parser.parse_args()
+    
     # Путь к файлу
-    file_path = input("Введите абсолютный путь к файлу (напимер 'C:\\Задание-3-данные.xlsx'):")
+    file_path = args.file_path
+    if not file_path:
+        file_path = input("Введите абсолютный путь к файлу (напимер 'C:\\Задание-3-данные.xlsx'):")
     
     # Проверяем существование файла
     if not os.path.exists(file_path):
@@ -152,70 +246,15 @@ def main():
         print(f"Ошибка при загрузке файла: {e}")
         return
     
-    # Создаем списки для результатов
-    decrypted_addresses = []
-    decrypted_emails = []
-    decrypted_phones = []
-    shifts = []
-    key_chars = []
-    
-    # Пропускаем первую строку (заголовок?) и обрабатываем остальные
-    for idx, row in data.iterrows():
-        # Получаем данные из колонок (индексы могут отличаться)
-        # В вашем файле: Unnamed: 1 - телефон, Unnamed: 2 - email, Unnamed: 3 - адрес
-        phone = str(row.iloc[1]) if len(row) > 1 else ""
-        email = str(row.iloc[2]) if len(row) > 2 else ""
-        address = str(row.iloc[3]) if len(row) > 3 else ""
-        
-        if not address or pd.isna(address) or address == 'nan':
-            print(f"Строка {idx+1}: пустой адрес, пропускаем")
-            continue
-        
-        # Извлекаем ключевую букву из адреса
-        key_char = extract_key_from_address(address)
-        
-        if not key_char:
-            print(f"Строка {idx+1}: не удалось извлечь ключ из адреса: {address[:50]}...")
-            continue
-        
-        # Расшифровываем адрес
-        decrypted_addr, shift = decrypt_address(address, key_char)
-        
-        # Расшифровываем email с тем же смещением
-        decrypted_eml = decrypt_email(email, -shift)
-        
-        # Расшифровываем телефон с тем же смещением (только строчные буквы)
-        decrypted_ph = decrypt_phone(phone, -shift)
-        
-        # Сохраняем результаты
-        decrypted_addresses.append(decrypted_addr)
-        decrypted_emails.append(decrypted_eml)
-        decrypted_phones.append(decrypted_ph)
-        shifts.append(-shift)  # минус для отображения как в вашем коде
-        key_chars.append(f"{key_char} -> {-shift}")
-        
-        # Выводим прогресс
-        print(f"\nСтрока {idx+1}:")
-        print(f"  Ключ: '{key_char}' -> смещение { -shift}")
-        print(f"  Адрес: {decrypted_addr}")
-        print(f"  Email: {decrypted_eml}")
-        print(f"  Телефон: {decrypted_ph}")
-    
-    # Создаем датасет с результатами
-    result_df = pd.DataFrame({
-        'Телефон (расшифрованный)': decrypted_phones,
-        'Email (расшифрованный)': decrypted_emails,
-        'Адрес (расшифрованный)': decrypted_addresses,
-        'Ключ шифрования (буква → смещение)': key_chars,
-        'Смещение': shifts
-    })
+    # Расшифровываем все строки сразу (подробный вывод по строкам - только по запросу)
+    result_df = decrypt_dataframe(data, verbose=args.verbose)
     
     # Сохраняем в новый Excel-файл
     output_file = "деобезличенные_данные.xlsx"
-    result_df.to_excel(output_file, index=False)
+    save_to_excel(result_df, output_file)
     
     print(f"\n" + "="*60)
-    print(f"Обработано строк: {len(decrypted_addresses)}")
+    print(f"Обработано строк: {len(result_df)}")
     print(f"Результаты сохранены в файл: {output_file}")
     print("="*60)
     
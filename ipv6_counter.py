@@ -10,8 +10,9 @@ import sys
 import argparse
 import tempfile
 import hashlib
-import struct
-import concurrent.futures
+import re
+import socket
+import multiprocessing
 import threading
 from pathlib import Path
 from typing import List, Tuple, Optional, Set
@@ -19,10 +20,71 @@ import mmap
 import heapq
 from collections import defaultdict
 
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # Без Numba адреса разбираются через inet_pton
+    numba = None
+
 # Константы
 IPV6_BYTES_LEN = 16  # IPv6 адрес в бинарном виде занимает 16 байт
+IPV6_HALF_DTYPE = np.dtype('>u8')  # Половина IPv6 адреса (8 байт, big-endian)
 TARGET_PARTITION_SIZE = 64 * 1024 * 1024  # 64 МБ на партицию (для безопасной работы в 1 ГБ RAM)
 HASH_SEED = 0x71C5E7B3  # Произвольная константа для хеш-функции
+HLL_SEED = 0x2F6B94D1  # Отдельная константа, чтобы хеш HyperLogLog не зависел от партиции
+READ_CHUNK_SIZE = 64 * 1024 * 1024  # Размер окна чтения входного файла
+# Порог сброса буфера партиции в файл; при 256 партициях буферы одного потока
+# занимают не больше 64 МБ
+FLUSH_BYTES = 256 * 1024
+MERGE_WRITE_BATCH = 8192  # Записей в одной операции записи при слиянии блоков
+# Память одного процесса пула: интерпретатор с numpy и numba (~100 МБ) плюс
+# обработка партиции или блока внешней сортировки (до TARGET_PARTITION_SIZE):
+# половины записей, порядок сортировки, отсортированные копии и временные
+# массивы lexsort - около 2.75 размера. Измеренный пик - 271 МБ
+WORKER_BASE_MEMORY_MB = 100
+WORKER_MEMORY_MB = WORKER_BASE_MEMORY_MB + 3 * TARGET_PARTITION_SIZE // (1024 * 1024)
+HLL_PRECISION = 14  # 2^14 регистров HyperLogLog, стандартная ошибка ~0.8%
+HLL_READ_SIZE = 4 * 1024 * 1024  # Размер блока при потоковом чтении партиции
+
+_inet_pton = getattr(socket, 'inet_pton', None)
+
+
+def _inet_pton6_available() -> bool:
+    """Проверяет, умеет ли socket.inet_pton разбирать IPv6 на этой платформе."""
+    try:
+        _inet_pton(socket.AF_INET6, '::')
+    except (TypeError, AttributeError, OSError):
+        return False
+    return True
+
+
+HAVE_INET_PTON6 = _inet_pton6_available()
+
+# Полный IPv6 адрес из 8 групп (для разбора без inet_pton)
+_FULL_IPV6_RE = re.compile(r'[0-9a-f]{1,4}(?::[0-9a-f]{1,4}){7}')
+
+# Результат разбора строки быстрым парсером
+PARSE_OK = 1        # адрес разобран
+PARSE_EMPTY = -1    # пустая строка
+PARSE_FALLBACK = 0  # ошибка или редкая форма записи - строку разбирает inet_pton
+
+# Значения hex-цифр по ASCII-коду (255 - не hex-цифра)
+_HEX_LUT = np.full(256, 255, dtype=np.uint8)
+for _value, _digit in enumerate('0123456789abcdef'):
+    _HEX_LUT[ord(_digit)] = _value
+    _HEX_LUT[ord(_digit.upper())] = _value
+del _value, _digit
+
+
+def _fadvise(f, advice: str):
+    """
+    Передает ядру подсказку о работе с файлом (os.posix_fadvise), например
+    'POSIX_FADV_SEQUENTIAL' для упреждающего чтения при последовательном проходе.
+    На платформах без posix_fadvise (Windows, macOS) ничего не делает.
+    """
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(f.fileno(), 0, 0, getattr(os, advice))
 
 
 class IPv6Parser:
@@ -33,11 +95,9 @@ class IPv6Parser:
         """
         Преобразует IPv6 строку в каноническую бинарную форму (16 байт).
         
-        Алгоритм:
-        1. Приводим к нижнему регистру
-        2. Обрабатываем сжатие '::'
-        3. Разбиваем на группы и конвертируем в числа
-        4. Упаковываем в 16 байт (big-endian)
+        Разбор выполняет системный inet_pton: он раскрывает сжатие '::',
+        не зависит от регистра и сразу возвращает 16 байт (big-endian).
+        Там, где inet_pton не поддерживает IPv6, используется разбор на Python.
         
         Args:
             addr_str: Строка с IPv6 адресом
@@ -45,117 +105,314 @@ class IPv6Parser:
         Returns:
             16 байт в бинарном представлении
         """
-        # Приводим к нижнему регистру для единообразия
-        addr = addr_str.lower().strip()
+        if not HAVE_INET_PTON6:
+            return IPv6Parser._parse_python(addr_str)
         
-        # Обработка сжатия '::'
-        if '::' in addr:
-            return IPv6Parser._expand_compressed(addr)
-        
-        # Обычный адрес без сжатия
-        groups = addr.split(':')
-        if len(groups) != 8:
-            raise ValueError(f"Неверное количество групп в IPv6 адресе: {addr}")
-        
-        return IPv6Parser._groups_to_bytes(groups)
+        try:
+            return _inet_pton(socket.AF_INET6, addr_str.strip())
+        except OSError:
+            raise ValueError(f"Некорректный IPv6 адрес: {addr_str}") from None
     
     @staticmethod
-    def _expand_compressed(addr: str) -> bytes:
+    def _parse_python(addr_str: str) -> bytes:
         """
-        Раскрывает сжатый IPv6 адрес с '::'.
+        Разбор IPv6 без inet_pton.
+        
+        Сжатие '::' раскрывается одним split, адрес проверяется одним
+        регулярным выражением и переводится в байты одним int(..., 16):
         
-        Пример: '2001:db0:0:123a::30' -> '2001:0db0:0000:123a:0000:0000:0000:0030'
+        '2001:db0:0:123a::30' -> '2001:db0:0:123a:0:0:0:30' -> 16 байт
         """
-        parts = addr.split('::')
-        if len(parts) != 2:
-            raise ValueError(f"Некорректное использование '::' в адресе: {addr}")
+        addr = addr_str.strip().lower()
+        
+        if '::' in addr:
+            parts = addr.split('::')
+            left = parts[0].split(':') if parts[0] else []
+            right = parts[-1].split(':') if parts[-1] else []
+            # '::' встречается не больше одного раза и заменяет хотя бы одну группу
+            missing = 8 - len(left) - len(right)
+            if len(parts) != 2 or missing < 1:
+                raise ValueError(f"Некорректный IPv6 адрес: {addr_str}")
+            groups = left + ['0'] * missing + right
+        else:
+            groups = addr.split(':')
         
-        left_groups = parts[0].split(':') if parts[0] else []
-        right_groups = parts[1].split(':') if parts[1] else []
+        full = ':'.join(groups)
+        if not _FULL_IPV6_RE.fullmatch(full):
+            raise ValueError(f"Некорректный IPv6 адрес: {addr_str}")
         
-        # Количество пропущенных групп
-        missing_groups = 8 - len(left_groups) - len(right_groups)
-        if missing_groups < 0:
-            raise ValueError(f"Слишком много групп в сжатом адресе: {addr}")
+        # Дополняем группы до 4 цифр и переводим все 32 hex-цифры разом
+        return int(''.join(group.rjust(4, '0') for group in groups), 16).to_bytes(16, 'big')
+    
+    @staticmethod
+    def parse_window(window: bytes) -> Tuple[np.ndarray, List[Tuple[str, str]]]:
+        """
+        Разбирает окно входного файла (строки, разделенные '\\n').
         
-        # Собираем полный список групп
-        all_groups = left_groups + ['0'] * missing_groups + right_groups
+        С Numba строки разбираются параллельно прямо по байтам, без создания
+        Python-строк; через inet_pton идут только строки, которые быстрый
+        парсер не принял (ошибки и редкие формы, например со встроенным IPv4).
+        Без Numba все строки разбираются через inet_pton.
         
-        return IPv6Parser._groups_to_bytes(all_groups)
+        Returns:
+            Массив записей формы (n, 16) и список (строка, ошибка) для
+            некорректных строк
+        """
+        if numba is None:
+            lines = window.decode('ascii', errors='replace').split('\n')
+            return IPv6Parser._parse_lines(lines)
+        
+        buf = np.frombuffer(window, dtype=np.uint8)
+        newlines = np.flatnonzero(buf == ord('\n'))
+        starts = np.concatenate(([0], newlines + 1))
+        ends = np.concatenate((newlines, [len(buf)]))
+        
+        records = np.empty((len(starts), IPV6_BYTES_LEN), dtype=np.uint8)
+        status = np.empty(len(starts), dtype=np.int8)
+        _parse_ipv6_lines(buf, starts, ends, records, status)
+        
+        # Строки, которые не разобрал быстрый парсер
+        fallback = np.flatnonzero(status == PARSE_FALLBACK)
+        lines = [window[starts[i]:ends[i]].decode('ascii', errors='replace') for i in fallback]
+        fallback_records, errors = IPv6Parser._parse_lines(lines)
+        
+        records = np.concatenate((records[status == PARSE_OK], fallback_records))
+        return records, errors
     
     @staticmethod
-    def _groups_to_bytes(groups: List[str]) -> bytes:
-        """
-        Конвертирует список hex-групп в 16 байт.
-        """
-        result = bytearray()
-        for group in groups:
-            # Удаляем ведущие нули и конвертируем в число
-            # Если группа пустая или '0', используем 0
-            if not group or group == '0':
-                value = 0
-            else:
-                # Убираем ведущие нули для парсинга
-                value = int(group.lstrip('0') or '0', 16)
-            
-            # Каждая группа - 2 байта (16 бит)
-            result.extend(struct.pack('>H', value))
+    def _parse_lines(lines: List[str]) -> Tuple[np.ndarray, List[Tuple[str, str]]]:
+        """Разбирает строки через inet_pton, пропуская пустые."""
+        to_bytes = IPv6Parser.to_canonical_bytes
+        parsed = []
+        errors = []
+        
+        for line in lines:
+            line = line.strip()
+            if not line:  # Пропускаем пустые строки (хотя по условию их нет)
+                continue
+            try:
+                # Парсим IPv6 в бинарное представление
+                parsed.append(to_bytes(line))
+            except ValueError as e:
+                errors.append((line, str(e)))
+        
+        records = np.frombuffer(b''.join(parsed), dtype=np.uint8).reshape(-1, IPV6_BYTES_LEN)
+        return records, errors
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _is_space(c):
+        """Пробельный ASCII-символ (тот же набор, что убирает str.strip)."""
+        return c == 32 or 9 <= c <= 13 or 28 <= c <= 31
+    
+    @numba.njit(cache=True)
+    def _parse_ipv6_ascii(buf, start, end, out):
+        """
+        Разбирает строку buf[start:end] (ASCII) в 16 байт out.
         
-        return bytes(result)
+        Принимает только обычную запись: группы из 1-4 hex-цифр через ':'
+        и не более одного '::'. Для всего остального возвращает
+        PARSE_FALLBACK, и строку разбирает inet_pton.
+        """
+        while start < end and _is_space(buf[start]):
+            start += 1
+        while end > start and _is_space(buf[end - 1]):
+            end -= 1
+        if start == end:
+            return PARSE_EMPTY
+        
+        groups = 0   # сколько групп записано в out
+        gap = -1     # номер группы, перед которой стоит '::'
+        i = start
+        
+        # ':' в начале допустим только как часть '::'
+        if buf[i] == 58:
+            if i + 1 == end or buf[i + 1] != 58:
+                return PARSE_FALLBACK
+            gap = 0
+            i += 2
+        
+        while i < end:
+            # Группа из 1-4 hex-цифр
+            value = 0
+            digits = 0
+            while i < end and digits <= 4:
+                digit = _HEX_LUT[buf[i]]
+                if digit == 255:
+                    break
+                value = value * 16 + digit
+                digits += 1
+                i += 1
+            if digits == 0 or digits > 4 or groups == 8:
+                return PARSE_FALLBACK
+            
+            out[2 * groups] = value >> 8
+            out[2 * groups + 1] = value & 0xFF
+            groups += 1
+            if i == end:
+                break
+            
+            # После группы - ':' или '::'
+            if buf[i] != 58 or i + 1 == end:
+                return PARSE_FALLBACK
+            i += 1
+            if buf[i] == 58:
+                if gap >= 0:
+                    return PARSE_FALLBACK
+                gap = groups
+                i += 1
+        
+        if gap < 0:
+            return PARSE_OK if groups == 8 else PARSE_FALLBACK
+        if groups > 7:
+            return PARSE_FALLBACK
+        
+        # Сдвигаем группы после '::' в конец адреса, пропуск заполняем нулями
+        tail = 2 * (groups - gap)
+        for k in range(tail):
+            out[15 - k] = out[2 * gap + tail - 1 - k]
+        for k in range(2 * gap, 16 - tail):
+            out[k] = 0
+        return PARSE_OK
+    
+    @numba.njit(parallel=True, cache=True)
+    def _parse_ipv6_lines(buf, starts, ends, out, status):
+        """Параллельно разбирает строки buf[starts[i]:ends[i]] в out[i]."""
+        for i in numba.prange(len(starts)):
+            status[i] = _parse_ipv6_ascii(buf, starts[i], ends[i], out[i])
+    
+    @numba.njit(cache=True)
+    def _mix64_scalar(x):
+        """Финализатор splitmix64 для одного uint64 (как FastHasher._mix64)."""
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        return x ^ (x >> np.uint64(31))
+    
+    @numba.njit(parallel=True, cache=True)
+    def _hash_halves(high, low, seed, out):
+        """
+        Тот же хеш, что FastHasher.hash_records, за один проход
+        без промежуточных массивов.
+        """
+        for i in numba.prange(len(high)):
+            out[i] = _mix64_scalar(high[i] ^ _mix64_scalar(low[i] ^ seed))
+    
+    @numba.njit(cache=True)
+    def _hash_halves_serial(high, low, seed, out):
+        """
+        Последовательный вариант _hash_halves для процессов пула: они и так
+        работают параллельно, и пул потоков Numba в каждом процессе не нужен.
+        """
+        for i in range(len(high)):
+            out[i] = _mix64_scalar(high[i] ^ _mix64_scalar(low[i] ^ seed))
 
 
 class FastHasher:
-    """Быстрая хеш-функция для равномерного распределения по партициям."""
+    """Быстрая векторная хеш-функция для равномерного распределения по партициям."""
+    
+    @staticmethod
+    def _mix64(x: np.ndarray) -> np.ndarray:
+        """Перемешивает биты 64-битных чисел (финализатор splitmix64)."""
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        return x ^ (x >> np.uint64(31))
     
     @staticmethod
-    def hash_bytes(data: bytes) -> int:
+    def hash_records(records: np.ndarray, seed: int, parallel: bool = True) -> np.ndarray:
         """
-        Вычисляет хеш от бинарных данных.
-        Используем модифицированный алгоритм FNV-1a для скорости.
-        
-        FNV-1a обеспечивает хорошее распределение и очень быстрый.
+        Вычисляет 64-битные хеши сразу для массива записей формы (n, 16).
+        Каждая запись рассматривается как пара uint64, обе половины
+        перемешиваются splitmix64. С Numba хеш считается одним проходом
+        (при parallel=True - на всех ядрах), без нее - операциями NumPy.
         """
-        hash_val = 0x811c9dc5  # FNV offset basis
-        fnv_prime = 0x01000193  # FNV prime
-        
-        for byte in data:
-            hash_val ^= byte
-            hash_val *= fnv_prime
-            # Ограничиваем до 32 бит для производительности
-            hash_val &= 0xffffffff
-        
-        return hash_val
+        halves = records.view(IPV6_HALF_DTYPE)
+        high = halves[:, 0].astype(np.uint64)
+        low = halves[:, 1].astype(np.uint64)
+        if numba is not None:
+            hashes = np.empty(len(records), dtype=np.uint64)
+            kernel = _hash_halves if parallel else _hash_halves_serial
+            kernel(high, low, np.uint64(seed), hashes)
+            return hashes
+        mix = FastHasher._mix64
+        return mix(high ^ mix(low ^ np.uint64(seed)))
     
     @staticmethod
-    def get_partition(data: bytes, num_partitions: int) -> int:
-        """Определяет номер партиции для данных."""
-        hash_val = FastHasher.hash_bytes(data)
-        return hash_val % num_partitions
+    def get_partitions(records: np.ndarray, num_partitions: int) -> np.ndarray:
+        """Определяет номера партиций для массива записей."""
+        hashes = FastHasher.hash_records(records, HASH_SEED)
+        return (hashes % np.uint64(num_partitions)).astype(np.intp)
 
 
 class PartitionWriter:
-    """Потокобезопасный писатель в партиции."""
+    """
+    Писатель в партиции.
+    
+    Каждый поток копит записи в собственных буферах (по одному на партицию)
+    без блокировок; в файл буфер сбрасывается под блокировкой партиции,
+    только когда накопится FLUSH_BYTES.
     
-    def __init__(self, num_partitions: int, temp_dir: str):
+    При thread_safe=False (единственный поток-писатель) блокировки и
+    буферы по потокам не создаются: используется один набор буферов.
+    """
+    
+    def __init__(self, num_partitions: int, temp_dir: str, thread_safe: bool = True):
         self.num_partitions = num_partitions
         self.temp_dir = temp_dir
+        self.thread_safe = thread_safe
         self.files = []
-        self.locks = []
+        self.locks = [threading.Lock() for _ in range(num_partitions)] if thread_safe else None
+        
+        # Буферы потоков: свои у каждого потока, общий список нужен для close()
+        if thread_safe:
+            self._local = threading.local()
+            self._thread_buffers = []
+            self._thread_buffers_lock = threading.Lock()
+        else:
+            self._thread_buffers = [[bytearray() for _ in range(num_partitions)]]
         
         # Создаем временные файлы для каждой партиции
         for i in range(num_partitions):
             fd, path = tempfile.mkstemp(dir=temp_dir, suffix=f'.part{i}')
             os.close(fd)  # Закрываем дескриптор, откроем позже через open()
             self.files.append(open(path, 'wb'))
-            self.locks.append(threading.Lock())
+    
+    def _get_buffers(self) -> List[bytearray]:
+        """Возвращает буферы текущего потока, создавая их при первом обращении."""
+        if not self.thread_safe:
+            return self._thread_buffers[0]
+        
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = [bytearray() for _ in range(self.num_partitions)]
+            self._local.buffers = buffers
+            with self._thread_buffers_lock:
+                self._thread_buffers.append(buffers)
+        return buffers
+    
+    def _flush(self, partition: int, buffer: bytearray):
+        """Сбрасывает буфер в файл партиции."""
+        if self.thread_safe:
+            with self.locks[partition]:
+                self.files[partition].write(buffer)
+        else:
+            self.files[partition].write(buffer)
+        buffer.clear()
     
     def write(self, partition: int, data: bytes):
-        """Потокобезопасная запись в партицию."""
-        with self.locks[partition]:
-            self.files[partition].write(data)
+        """Запись в партицию (через буфер текущего потока)."""
+        buffer = self._get_buffers()[partition]
+        buffer += data
+        if len(buffer) >= FLUSH_BYTES:
+            self._flush(partition, buffer)
     
     def close(self):
-        """Закрывает все файлы."""
+        """Сбрасывает остатки буферов всех потоков и закрывает все файлы."""
+        for buffers in self._thread_buffers:
+            for partition, buffer in enumerate(buffers):
+                if buffer:
+                    self._flush(partition, buffer)
+        
         for f in self.files:
             f.close()
     
@@ -164,6 +421,85 @@ class PartitionWriter:
         return [f.name for f in self.files]
 
 
+class HyperLogLog:
+    """
+    Приближенный счетчик уникальных записей (HyperLogLog).
+    Занимает 2^precision байт памяти независимо от количества записей.
+    """
+    
+    def __init__(self, precision: int = HLL_PRECISION):
+        # Ранг считается по 53 старшим битам остатка хеша (точно в float64),
+        # поэтому под номер регистра должно уходить не меньше 11 бит
+        if not 11 <= precision <= 18:
+            raise ValueError(f"Точность HyperLogLog должна быть от 11 до 18: {precision}")
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+    
+    def update_batch(self, records: np.ndarray):
+        """Добавляет пачку записей (массив формы (n, 16))."""
+        # Счетчик работает в процессах пула - хеш считается в одном потоке
+        hashes = FastHasher.hash_records(records, HLL_SEED, parallel=False)
+        
+        # Старшие биты хеша - номер регистра
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+        
+        # Ранг - позиция первой единицы в оставшихся битах
+        rest = (hashes << np.uint64(self.precision)) >> np.uint64(11)
+        _, bit_length = np.frexp(rest.astype(np.float64))
+        rank = np.minimum(54 - bit_length, 64 - self.precision + 1).astype(np.uint8)
+        
+        np.maximum.at(self.registers, index, rank)
+    
+    @staticmethod
+    def _sigma(x: float) -> float:
+        """Поправка на пустые регистры (ряд sigma из оценки Ertl)."""
+        if x == 1.0:
+            return float('inf')
+        y = 1.0
+        z = x
+        while True:
+            x *= x
+            z_prev = z
+            z += x * y
+            y += y
+            if z == z_prev:
+                return z
+    
+    @staticmethod
+    def _tau(x: float) -> float:
+        """Поправка на переполненные регистры (ряд tau из оценки Ertl)."""
+        if x == 0.0 or x == 1.0:
+            return 0.0
+        y = 1.0
+        z = 1.0 - x
+        while True:
+            x = np.sqrt(x)
+            z_prev = z
+            y *= 0.5
+            z -= (1.0 - x) ** 2 * y
+            if z == z_prev:
+                return z / 3
+    
+    def count(self) -> int:
+        """
+        Оценка количества уникальных записей.
+        
+        Используется улучшенная оценка Ertl (2017) по гистограмме регистров:
+        она учитывает пустые и переполненные регистры без переключения на
+        линейный подсчет, поэтому не смещена и возле бывшего порога 2.5 * m.
+        """
+        m = len(self.registers)
+        q = 64 - self.precision
+        counts = np.bincount(self.registers, minlength=q + 2)
+        
+        z = m * self._tau(1.0 - counts[q + 1] / m)
+        for k in range(q, 0, -1):
+            z = 0.5 * (z + counts[k])
+        z += m * self._sigma(counts[0] / m)
+        
+        return int(round(m * m / (2 * np.log(2) * z)))
+
+
 class PartitionProcessor:
     """Обработчик одной партиции для подсчета уникальных адресов."""
     
@@ -189,28 +525,52 @@ class PartitionProcessor:
             return PartitionProcessor._count_unique_external(partition_path)
     
     @staticmethod
-    def _count_unique_in_memory(partition_path: str) -> int:
-        """Подсчет уникальных записей с загрузкой в память."""
-        records = []
+    def count_approximate(partition_path: str) -> int:
+        """
+        Приближенно подсчитывает количество уникальных IPv6 адресов в партиции.
+        
+        Файл читается потоково блоками по HLL_READ_SIZE и передается в
+        HyperLogLog, поэтому память не зависит от размера партиции и
+        сортировка не нужна.
+        """
+        hll = HyperLogLog()
         with open(partition_path, 'rb') as f:
+            _fadvise(f, 'POSIX_FADV_SEQUENTIAL')
             while True:
-                chunk = f.read(IPV6_BYTES_LEN)
+                chunk = f.read(HLL_READ_SIZE)
                 if not chunk:
                     break
-                records.append(chunk)
-        
-        # Сортируем для группировки одинаковых
-        records.sort()
+                hll.update_batch(np.frombuffer(chunk, dtype=np.uint8).reshape(-1, IPV6_BYTES_LEN))
         
-        # Подсчет уникальных
-        unique_count = 0
-        prev = None
-        for record in records:
-            if record != prev:
-                unique_count += 1
-                prev = record
+        return hll.count()
+    
+    @staticmethod
+    def _count_unique_in_memory(partition_path: str) -> int:
+        """
+        Подсчет уникальных записей с загрузкой в память.
         
-        return unique_count
+        Каждая 16-байтная запись рассматривается как пара uint64 (старшая и
+        младшая половины, big-endian): порядок пар совпадает с порядком
+        исходных байт, а сравнение записи сводится к двум сравнениям чисел.
+        Сортировка и подсчет уникальных идут в C (NumPy).
+        """
+        with open(partition_path, 'rb') as f:
+            _fadvise(f, 'POSIX_FADV_SEQUENTIAL')
+            halves = np.frombuffer(f.read(), dtype=IPV6_HALF_DTYPE).reshape(-1, 2)
+        
+        if len(halves) == 0:
+            return 0
+        
+        # Переводим половины в родной порядок байт и сортируем пары
+        high = halves[:, 0].astype(np.uint64)
+        low = halves[:, 1].astype(np.uint64)
+        del halves  # Прочитанный файл больше не нужен
+        order = np.lexsort((low, high))
+        high, low = high[order], low[order]
+        
+        # Уникальные = первая запись + все, отличающиеся от предыдущей
+        changed = (high[1:] != high[:-1]) | (low[1:] != low[:-1])
+        return int(np.count_nonzero(changed)) + 1
     
     @staticmethod
     def _count_unique_external(partition_path: str) -> int:
@@ -226,6 +586,7 @@ class PartitionProcessor:
         prev = None
         
         with open(sorted_path, 'rb') as f:
+            _fadvise(f, 'POSIX_FADV_SEQUENTIAL')
             while True:
                 chunk = f.read(IPV6_BYTES_LEN)
                 if not chunk:
@@ -255,70 +616,89 @@ class PartitionProcessor:
         temp_files = []
         
         # Фаза 1: Разбиение на отсортированные блоки
+        # Блок сортируется как в _count_unique_in_memory - парами uint64
+        # (порядок пар совпадает с порядком байт записей), поэтому памяти
+        # нужно столько же, сколько на партицию в памяти
         with open(input_path, 'rb') as f:
+            _fadvise(f, 'POSIX_FADV_SEQUENTIAL')
             while True:
-                block = []
-                for _ in range(records_per_block):
-                    record = f.read(IPV6_BYTES_LEN)
-                    if not record:
-                        break
-                    block.append(record)
-                
-                if not block:
+                data = f.read(records_per_block * IPV6_BYTES_LEN)
+                if not data:
                     break
                 
                 # Сортируем блок
-                block.sort()
+                records = np.frombuffer(data, dtype=np.uint8).reshape(-1, IPV6_BYTES_LEN)
+                halves = records.view(IPV6_HALF_DTYPE)
+                order = np.lexsort((halves[:, 1], halves[:, 0]))
                 
-                # Записываем во временный файл
+                # Записываем во временный файл одним блоком
                 fd, temp_path = tempfile.mkstemp()
                 with os.fdopen(fd, 'wb') as temp_f:
-                    for record in block:
-                        temp_f.write(record)
+                    temp_f.write(records[order])
                 
                 temp_files.append(temp_path)
+                # Освобождаем блок до чтения следующего
+                del data, records, halves, order
         
         # Фаза 2: Слияние
+        # Блоки отображаются в память, записи читаются из mmap и сливаются
+        # генератором heapq.merge (чистый Python); результат пишется
+        # пачками по MERGE_WRITE_BATCH записей
+        file_handles = [open(temp_path, 'rb') for temp_path in temp_files]
+        block_maps = [mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) for f in file_handles]
+        block_iters = [PartitionProcessor._iter_records(mm) for mm in block_maps]
+        
         result_fd, result_path = tempfile.mkstemp()
         with os.fdopen(result_fd, 'wb') as result_f:
-            # Используем кучу для слияния
-            heap = []
-            file_handles = []
-            
-            # Открываем все временные файлы
-            for temp_path in temp_files:
-                f = open(temp_path, 'rb')
-                file_handles.append(f)
-                first_record = f.read(IPV6_BYTES_LEN)
-                if first_record:
-                    heapq.heappush(heap, (first_record, len(file_handles) - 1))
+            batch = []
+            for record in heapq.merge(*block_iters):
+                batch.append(record)
+                if len(batch) == MERGE_WRITE_BATCH:
+                    result_f.write(b''.join(batch))
+                    batch.clear()
             
-            # Сливаем
-            while heap:
-                record, file_idx = heapq.heappop(heap)
-                result_f.write(record)
-                
-                # Читаем следующий record из того же файла
-                next_record = file_handles[file_idx].read(IPV6_BYTES_LEN)
-                if next_record:
-                    heapq.heappush(heap, (next_record, file_idx))
-            
-            # Закрываем все файлы
-            for f in file_handles:
-                f.close()
-            
-            # Удаляем временные файлы блоков
-            for temp_path in temp_files:
-                os.unlink(temp_path)
+            if batch:
+                result_f.write(b''.join(batch))
+        
+        # Закрываем все файлы
+        for mm in block_maps:
+            mm.close()
+        for f in file_handles:
+            f.close()
+        
+        # Удаляем временные файлы блоков
+        for temp_path in temp_files:
+            os.unlink(temp_path)
         
         return result_path
+    
+    @staticmethod
+    def _iter_records(mm: mmap.mmap):
+        """Перебирает 16-байтные записи отображенного в память файла."""
+        for offset in range(0, len(mm), IPV6_BYTES_LEN):
+            yield mm[offset:offset + IPV6_BYTES_LEN]
+
+
+def _count_partition(task: Tuple[str, bool]) -> Tuple[str, Optional[int], Optional[str]]:
+    """
+    Обрабатывает одну партицию в процессе пула.
+    Ошибка возвращается вместе с путем, чтобы не прерывать обработку остальных партиций.
+    """
+    path, approximate = task
+    try:
+        if approximate:
+            return path, PartitionProcessor.count_approximate(path), None
+        return path, PartitionProcessor.count_unique(path), None
+    except Exception as e:
+        return path, None, str(e)
 
 
 class IPv6UniqueCounter:
     """Основной класс для подсчета уникальных IPv6 адресов."""
     
-    def __init__(self, memory_limit_mb: int = 1024):
+    def __init__(self, memory_limit_mb: int = 1024, approximate: bool = False):
         self.memory_limit_mb = memory_limit_mb
+        self.approximate = approximate
         self.temp_dir = None
     
     def count_unique(self, input_path: str, output_path: str):
@@ -376,51 +756,57 @@ class IPv6UniqueCounter:
     def _distribute_addresses(self, input_path: str, num_partitions: int) -> PartitionWriter:
         """
         Первый проход: читает входной файл, парсит адреса и распределяет по партициям.
-        Использует memory-mapped файл для эффективного чтения.
+        Использует memory-mapped файл и обрабатывает его большими окнами:
+        адреса окна разбираются в массив, партиции считаются векторно,
+        а в каждую партицию пишется одним блоком.
         """
-        writer = PartitionWriter(num_partitions, self.temp_dir)
+        # Входной файл читается одним потоком - блокировки писателю не нужны
+        writer = PartitionWriter(num_partitions, self.temp_dir, thread_safe=False)
         
         # Используем memory-mapped файл для быстрого чтения
         with open(input_path, 'rb') as f:
+            _fadvise(f, 'POSIX_FADV_SEQUENTIAL')
             with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
-                # Читаем файл построчно
+                # Файл читается строго по порядку - включаем упреждающее чтение
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                
                 start = 0
-                while True:
-                    # Ищем конец строки
-                    end = mm.find(b'\n', start)
-                    if end == -1:
-                        # Последняя строка без перевода строки
-                        line = mm[start:].decode('utf-8').strip()
-                        if line:
-                            self._process_line(line, writer, num_partitions)
-                        break
+                while start < len(mm):
+                    # Окно заканчивается на конце строки, чтобы не разрезать адрес
+                    end = mm.find(b'\n', start + READ_CHUNK_SIZE)
+                    end = len(mm) if end == -1 else end + 1
+                    
+                    records, errors = IPv6Parser.parse_window(mm[start:end])
+                    for line, error in errors:
+                        print(f"Ошибка при обработке строки '{line}': {error}", file=sys.stderr)
+                        # Продолжаем обработку других строк
                     
-                    # Обрабатываем строку
-                    line = mm[start:end].decode('utf-8').strip()
-                    if line:  # Пропускаем пустые строки (хотя по условию их нет)
-                        self._process_line(line, writer, num_partitions)
+                    self._write_records(records, writer, num_partitions)
                     
-                    start = end + 1
+                    start = end
+            
+            # Входной файл больше не нужен - освобождаем его страницы в кеше
+            _fadvise(f, 'POSIX_FADV_DONTNEED')
         
         writer.close()
         return writer
     
-    def _process_line(self, line: str, writer: PartitionWriter, num_partitions: int):
+    def _write_records(self, records: np.ndarray, writer: PartitionWriter, num_partitions: int):
         """
-        Обрабатывает одну строку: парсит IPv6 и записывает в соответствующую партицию.
+        Группирует записи по партициям и записывает каждую группу одним вызовом.
         """
-        try:
-            # Парсим IPv6 в бинарное представление
-            ip_bytes = IPv6Parser.to_canonical_bytes(line)
-            
-            # Определяем партицию по хешу
-            partition = FastHasher.get_partition(ip_bytes, num_partitions)
-            
-            # Записываем
-            writer.write(partition, ip_bytes)
-        except Exception as e:
-            print(f"Ошибка при обработке строки '{line}': {e}", file=sys.stderr)
-            # Продолжаем обработку других строк
+        # Определяем партиции по хешу и упорядочиваем записи по партициям
+        partitions = FastHasher.get_partitions(records, num_partitions)
+        records = records[np.argsort(partitions, kind='stable')]
+        bounds = np.cumsum(np.bincount(partitions, minlength=num_partitions))
+        
+        # Записываем
+        start = 0
+        for partition, end in enumerate(bounds):
+            if end > start:
+                writer.write(partition, records[start:end].tobytes())
+            start = end
     
     def _process_partitions(self, partition_paths: List[str]) -> int:
         """
@@ -428,25 +814,44 @@ class IPv6UniqueCounter:
         """
         total_unique = 0
         
-        # Используем ProcessPoolExecutor для параллельной обработки
-        # Каждая партиция обрабатывается в отдельном процессе
-        with concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
-            # Запускаем задачи
-            future_to_path = {
-                executor.submit(PartitionProcessor.count_unique, path): path
-                for path in partition_paths
-            }
+        # Число процессов ограничено не только ядрами, но и памятью:
+        # одновременно обрабатываются не больше workers партиций, каждый
+        # процесс занимает до WORKER_MEMORY_MB, итого не больше memory_limit_mb.
+        # Внешняя сортировка держит в памяти один блок той же величины; при
+        # слиянии блоки отображены через mmap - это страницы файлового кеша,
+        # которые система может вытеснить
+        workers = max(1, min(os.cpu_count() or 1, self.memory_limit_mb // WORKER_MEMORY_MB))
+        print(f"Используем {workers} процессов для обработки партиций", file=sys.stderr)
+        
+        tasks = [(path, self.approximate) for path in partition_paths]
+        
+        # maxtasksperchild=1: процесс завершается после каждой партиции
+        # и возвращает всю занятую память системе
+        # Процессы создаются через forkserver, где он есть: fork напрямую из
+        # процесса, в котором уже работали потоки Numba, может оставить
+        # дочерний процесс в неработоспособном состоянии
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else None
+        context = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver':
+            # Этот модуль вместе с numpy и numba импортируется один раз в сервере,
+            # процессы пула получают их уже загруженными (при запуске скриптом
+            # __name__ == '__main__'; отсутствующий numba сервер пропускает)
+            context.set_forkserver_preload([__name__, 'numpy', 'numba'])
+        with context.Pool(workers, maxtasksperchild=1) as pool:
+            for path, unique_count, error in pool.imap_unordered(_count_partition, tasks,
+                                                                 chunksize=1):
+                if error is not None:
+                    print(f"Ошибка при обработке партиции {path}: {error}", file=sys.stderr)
+                    continue
+                
+                total_unique += unique_count
+                print(f"Партиция {os.path.basename(path)}: {unique_count} уникальных", 
+                      file=sys.stderr)
             
-            # Собираем результаты
-            for future in concurrent.futures.as_completed(future_to_path):
-                path = future_to_path[future]
-                try:
-                    unique_count = future.result()
-                    total_unique += unique_count
-                    print(f"Партиция {os.path.basename(path)}: {unique_count} уникальных", 
-                          file=sys.stderr)
-                except Exception as e:
-                    print(f"Ошибка при обработке партиции {path}: {e}", file=sys.stderr)
+            # Выход из with вызывает terminate(): процессы дожидаемся явно,
+            # чтобы они успели освободить свои ресурсы (семафоры)
+            pool.close()
+            pool.join()
         
         return total_unique
 
@@ -470,6 +875,11 @@ def main():
         default=1024,
         help="Лимит памяти в МБ (по умолчанию: 1024)"
     )
+    parser.add_argument(
+        "--approximate",
+        action="store_true",
+        help="Приближенный подсчет через HyperLogLog (погрешность около 1%%)"
+    )
     
     args = parser.parse_args()
     
@@ -480,7 +890,8 @@ def main():
     
     try:
         # Создаем счетчик и запускаем обработку
-        counter = IPv6UniqueCounter(memory_limit_mb=args.memory_limit)
+        counter = IPv6UniqueCounter(memory_limit_mb=args.memory_limit,
+                                   approximate=args.approximate)
         counter.count_unique(args.input_file, args.output_file)
         
         print(f"Результат сохранен в '{args.output_file}'", file=sys.stderr)
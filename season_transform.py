@@ -1,49 +1,112 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
 
-def apply_color_transfer(source, target, mask):
+# Диапазоны HSV листвы по сезонам
+# Осень - желто-красные тона (Hue 0-85)
+_AUTUMN_LO = np.array([0, 20, 20])
+_AUTUMN_HI = np.array([85, 255, 255])
+# Лето - зеленые тона (Hue 35-90)
+_SUMMER_LO = np.array([35, 20, 20])
+_SUMMER_HI = np.array([90, 255, 255])
+_RANGES = {
+    'autumn': (_AUTUMN_LO, _AUTUMN_HI),
+    'summer': (_SUMMER_LO, _SUMMER_HI),
+}
+
+
+# Ядро морфологической очистки маски. Прямоугольное ядро OpenCV
+# само раскладывает на два одномерных прохода
+MORPH_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+# Запас строк для морфологии по полосам: CLOSE и OPEN ядром 3x3 -
+# это четыре прохода радиуса 1
+MORPH_HALO = 4
+
+# Изображение обрабатывается горизонтальными полосами примерно по STRIP_PIXELS
+# пикселей: полоса исходника, ее маска, Lab и результат (~10 байт на пиксель)
+# помещаются в кэш L2, пока по ним проходят все этапы конвейера
+STRIP_PIXELS = 128 * 1024
+# Но не ниже STRIP_MIN_ROWS строк: маска каждой полосы считается с запасом
+# 2 * MORPH_HALO строк, и на широких кадрах (32 строки при ширине 4000)
+# он занимал бы до четверти всей работы над маской, а так - не больше ~6%
+STRIP_MIN_ROWS = 128
+
+
+def to_lab(image):
     """
-    Переносит цветовую статистику с target на source в пространстве Lab
-    только для области, заданной маской.
+    Конвертирует BGR изображение в Lab прямо в uint8
+    (L в [0, 255], a и b со смещением 128) - без промежуточного float.
     """
-    if np.sum(mask) == 0:
-        return source  # Нет пикселей для обработки
+    return cv2.cvtColor(image, cv2.COLOR_BGR2Lab)
 
-    # Конвертируем в float для точности вычислений
-    source_float = source.astype(np.float32) / 255.0
-    target_float = target.astype(np.float32) / 255.0
 
-    # Конвертируем в Lab
-    source_lab = cv2.cvtColor(source_float, cv2.COLOR_BGR2Lab)
-    target_lab = cv2.cvtColor(target_float, cv2.COLOR_BGR2Lab)
-    result_lab = source_lab.copy()
+def lab_stats(lab, mask=None):
+    """
+    Среднее и стандартное отклонение каналов L, a, b (по маске, если она задана)
+    за один проход OpenCV.
+    """
+    mean, std = cv2.meanStdDev(lab, mask=mask)
+    return mean.ravel().astype(np.float32), std.ravel().astype(np.float32)
 
-    # Применяем перенос цвета только по маске
-    for i in range(3):  # Для каналов L, a, b
-        source_channel = source_lab[:, :, i][mask > 0]
-        target_channel = target_lab[:, :, i].flatten() # Берем всю статистику с таргета (или тоже можно по маске, но сложнее)
 
-        # Можно взять статистику по всему таргету, либо по его маске, если мы ее построили.
-        # Для простоты возьмем по всему таргету.
-        mean_target = np.mean(target_channel)
-        std_target = np.std(target_channel)
+def compute_lab_stats(image, mask=None):
+    """
+    Цветовая статистика BGR изображения в пространстве Lab.
+    Для донора ее достаточно посчитать один раз и переиспользовать.
+    """
+    return lab_stats(to_lab(image), mask)
 
-        mean_source = np.mean(source_channel)
-        std_source = np.std(source_channel)
 
-        if std_source == 0:
-            std_source = 1 # Защита от деления на ноль
+def transfer_table(ms, ss, mt, st):
+    """
+    Таблица cv2.LUT (1 x 256 x 3) для переноса статистики (ms, ss) -> (mt, st).
+    В uint8 Lab перенос - аффинное преобразование каждого канала,
+    поэтому его достаточно посчитать для 256 значений.
+    """
+    values = np.arange(256, dtype=np.float32)[:, None]
+    table = (values - ms) * (st / ss) + mt + 0.5
+    return np.clip(table, 0, 255).astype(np.uint8).reshape(1, 256, 3)
 
-        # Создаем временный слой
-        layer = source_lab[:, :, i].copy()
-        # Применяем формулу только к маскированным пикселям
-        layer[mask > 0] = ((layer[mask > 0] - mean_source) *
-                          (std_target / std_source) + mean_target)
-        result_lab[:, :, i] = layer
 
-    # Конвертируем обратно в BGR
-    result_bgr = cv2.cvtColor(result_lab, cv2.COLOR_Lab2BGR)
-    return np.clip(result_bgr * 255, 0, 255).astype(np.uint8)
+def transfer_lab(lab, mask, ms, ss, mt, st):
+    """
+    Переносит статистику (ms, ss) -> (mt, st) на пиксели lab под маской, на месте.
+    Таблица применяется ко всему изображению (без ветвлений по маске),
+    затем результат копируется по маске.
+    """
+    cv2.copyTo(cv2.LUT(lab, transfer_table(ms, ss, mt, st)), mask, lab)
+
+
+def apply_color_transfer_with_stats(source, mask, target_mean, target_std):
+    """
+    Переносит заранее посчитанную статистику target_mean, target_std на source
+    только для области, заданной маской.
+    """
+    if cv2.countNonZero(mask) == 0:
+        return source  # Нет пикселей для обработки
+
+    source_lab = to_lab(source)
+
+    # Статистика исходника - только по маске
+    ms, ss = lab_stats(source_lab, mask)
+    ss = np.where(ss == 0, 1, ss).astype(np.float32)  # Защита от деления на ноль
+
+    # Применяем перенос цвета только по маске, прямо в source_lab
+    transfer_lab(source_lab, mask, ms, ss, target_mean, target_std)
+
+    # Конвертируем обратно в BGR (uint8 -> uint8)
+    return cv2.cvtColor(source_lab, cv2.COLOR_Lab2BGR)
+
+
+def apply_color_transfer(source, target, mask):
+    """
+    Переносит цветовую статистику с target на source в пространстве Lab
+    только для области, заданной маской.
+    Статистику таргета берем по всему изображению.
+    """
+    target_mean, target_std = compute_lab_stats(target)
+    return apply_color_transfer_with_stats(source, mask, target_mean, target_std)
 
 
 def create_foliage_mask(image, season='autumn'):
@@ -53,69 +116,222 @@ def create_foliage_mask(image, season='autumn'):
     """
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
 
-    if season == 'autumn':
-        # Диапазон для желто-красных тонов (Hue 10-85)
-        lower = np.array([0, 20, 20])
-        upper = np.array([85, 255, 255])
-    else: # summer
-        # Диапазон для зеленого (Hue 35-85)
-        lower = np.array([35, 20, 20])
-        upper = np.array([90, 255, 255])
-
+    # Все, кроме осени, считается летом
+    lower, upper = _RANGES['autumn' if season == 'autumn' else 'summer']
     mask = cv2.inRange(hsv, lower, upper)
 
     # Морфологическая очистка
-    kernel = np.ones((3, 3), np.uint8)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, MORPH_KERNEL)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, MORPH_KERNEL)
 
     return mask
 
 
-def transform_season(input_path, donor_path, output_path, input_season, donor_season):
+def strip_rows(width):
     """
-    Основная функция трансформации.
+    Высота полосы в строках для изображения ширины width.
+    """
+    return max(STRIP_MIN_ROWS, STRIP_PIXELS // width)
+
+
+def iter_strips(height, width):
+    """
+    Границы горизонтальных полос изображения (y0, y1).
+    """
+    rows = strip_rows(width)
+    for y0 in range(0, height, rows):
+        yield y0, min(y0 + rows, height)
+
+
+def segment_foliage_by_strips(image, season):
+    """
+    Первый проход конвейера по полосам: маска листвы (с запасом строк
+    для морфологии), Lab и статистика исходника по маске.
+    Возвращает (mask, lab, mean, std) или None, если листвы нет.
+    """
+    height, width = image.shape[:2]
+    mask = np.empty((height, width), np.uint8)
+    lab = np.empty_like(image)
+
+    count = 0
+    sums = np.zeros(3)
+    squares = np.zeros(3)
+    for y0, y1 in iter_strips(height, width):
+        top = max(0, y0 - MORPH_HALO)
+        bottom = min(height, y1 + MORPH_HALO)
+        mask[y0:y1] = create_foliage_mask(image[top:bottom], season)[y0 - top:y1 - top]
+        cv2.cvtColor(image[y0:y1], cv2.COLOR_BGR2Lab, dst=lab[y0:y1])
+
+        strip_count = cv2.countNonZero(mask[y0:y1])
+        if strip_count:
+            # meanStdDev отдает float64 - накапливаем без промежуточного float32
+            mean, std = (v.ravel() for v in cv2.meanStdDev(lab[y0:y1], mask=mask[y0:y1]))
+            count += strip_count
+            sums += strip_count * mean
+            squares += strip_count * (std ** 2 + mean ** 2)
+
+    if count == 0:
+        return None  # Нет пикселей для обработки
+
+    ms = sums / count
+    ss = np.sqrt(np.maximum(squares / count - ms ** 2, 0))
+    ss = np.where(ss == 0, 1, ss)  # Защита от деления на ноль
+    return mask, lab, ms.astype(np.float32), ss.astype(np.float32)
+
+
+def transfer_foliage_by_strips(image, segmented, target_mean, target_std):
+    """
+    Второй проход конвейера по полосам: перенос цвета в Lab,
+    обратно в BGR и наложение на исходник по маске.
+    """
+    if segmented is None:
+        return image  # Нет пикселей для обработки
+
+    mask, lab, ms, ss = segmented
+    height, width = image.shape[:2]
+    table = transfer_table(ms, ss, target_mean, target_std)
+    # Исходник не изменяется: фон копируется в результат полосами,
+    # вместе с остальными этапами, а не отдельным проходом по всему изображению
+    result = np.empty_like(image)
+    # Lab -> BGR (uint8 -> uint8, без масштабирования и обрезки) пишется
+    # в один и тот же буфер полосы, а не в новый массив на каждой полосе
+    strip_bgr = np.empty((min(height, strip_rows(width)), width, 3), np.uint8)
+    for y0, y1 in iter_strips(height, width):
+        bgr = strip_bgr[:y1 - y0]
+        # Таблица применяется ко всей полосе: пиксели вне маски
+        # все равно отбрасываются при наложении
+        cv2.LUT(lab[y0:y1], table, dst=lab[y0:y1])
+        cv2.cvtColor(lab[y0:y1], cv2.COLOR_Lab2BGR, dst=bgr)
+        result[y0:y1] = image[y0:y1]
+        cv2.copyTo(bgr, mask[y0:y1], result[y0:y1])
+
+    return result
+
+
+def transform_foliage_by_strips(image, season, target_mean, target_std):
+    """
+    Весь конвейер (маска -> Lab -> перенос цвета -> BGR -> наложение) по полосам,
+    чтобы промежуточные данные полосы не успевали уйти из кэша.
+    Статистика исходника нужна целиком до переноса, поэтому проходов два.
+    """
+    segmented = segment_foliage_by_strips(image, season)
+    return transfer_foliage_by_strips(image, segmented, target_mean, target_std)
+
+
+def compute_donor_stats(img_donor, donor_season):
+    """
+    Статистика донора только по его листве: фон не размывает средние
+    и отклонения, а на не-листве статистика вовсе не считается.
+    Если листвы на доноре не нашлось, берется все изображение.
+    """
+    donor_mask = create_foliage_mask(img_donor, donor_season)
+    if cv2.countNonZero(donor_mask) == 0:
+        return compute_lab_stats(img_donor)
+    return compute_lab_stats(img_donor, donor_mask)
+
+
+def save_image(output_path, image):
+    """
+    Кодирует и записывает изображение на диск.
+    """
+    if cv2.imwrite(output_path, image):
+        print(f"Изображение сохранено как {output_path}")
+    else:
+        print(f"Ошибка сохранения изображения {output_path}")
+
+
+def transform_season_images(img_src, img_donor, output_path, input_season, donor_season,
+                            write_executor=None):
+    """
+    Трансформация уже загруженных изображений (входные массивы не изменяются).
     input_season: сезон исходного фото ('summer' или 'autumn')
     donor_season: сезон фото-донора (противоположный)
+    write_executor: пул для фоновой записи (необязательно) - тогда возвращается
+    Future записи, и ее результат нужно дождаться; без него файл пишется сразу.
     """
-    # 1. Загрузка
-    img_src = cv2.imread(input_path)
-    img_donor = cv2.imread(donor_path)
+    # 1. Статистика донора (по его листве) считается один раз,
+    #    сам донор в перенос не передается
+    donor_mean, donor_std = compute_donor_stats(img_donor, donor_season)
 
-    if img_src is None or img_donor is None:
-        print("Ошибка загрузки изображений")
-        return
+    # 2. Сегментация листвы, перенос цвета по маске и наложение на исходник
+    #    (фон остается нетронутым) - по полосам
+    final_image = transform_foliage_by_strips(img_src, input_season, donor_mean, donor_std)
+
+    # 3. Сохранение
+    if write_executor is not None:
+        return write_executor.submit(save_image, output_path, final_image)
+    save_image(output_path, final_image)
+
+
+def load_donor_stats(donor_path, donor_season):
+    """
+    Загружает донора и сразу считает его статистику - больше от донора ничего не нужно.
+    """
+    img_donor = cv2.imread(donor_path, cv2.IMREAD_COLOR)
+    if img_donor is None:
+        return None
+    return compute_donor_stats(img_donor, donor_season)
 
-    # 2. Сегментация листвы на исходном изображении
-    foliage_mask = create_foliage_mask(img_src, input_season)
 
-    # 3. Расширяем маску до 3 каналов (для удобства умножения)
-    mask_3channel = cv2.merge([foliage_mask, foliage_mask, foliage_mask]) / 255
+def transform_season(input_path, donor_path, output_path, input_season, donor_season, executor=None):
+    """
+    Основная функция трансформации.
+    input_season: сезон исходного фото ('summer' или 'autumn')
+    donor_season: сезон фото-донора (противоположный)
+    executor: пул потоков вызывающего кода (необязательно) - с ним донор
+    декодируется, пока строится маска исходника; без него файлы читаются по очереди.
+    """
+    # 1. Загрузка
+    if executor is not None:
+        future_src = executor.submit(cv2.imread, input_path)
+        future_donor = executor.submit(load_donor_stats, donor_path, donor_season)
+        img_src = future_src.result()
+    else:
+        img_src = cv2.imread(input_path)
 
-    # 4. Изолируем фон и листву (фон нам не нужен для расчета статистики, но пригодится для сборки)
-    #    Умножаем исходник на инвертированную маску, чтобы получить фон.
-    background = img_src * (1 - mask_3channel)
+    # 2. Сегментация листвы и Lab исходника
+    segmented = segment_foliage_by_strips(img_src, input_season) if img_src is not None else None
 
-    # 5. Применяем перенос цвета к исходному изображению,
-    #    но ограничиваясь маской внутри функции apply_color_transfer.
-    #    ВНИМАНИЕ: мы передаем всё изображение, но функция меняет только пиксели под маской.
-    img_transformed = apply_color_transfer(img_src, img_donor, foliage_mask)
+    if executor is not None:
+        donor_stats = future_donor.result()
+    else:
+        donor_stats = load_donor_stats(donor_path, donor_season)
 
-    # 6. Выделяем измененную листву из результата и накладываем на сохраненный фон
-    new_foliage = img_transformed * mask_3channel
-    final_image = (background + new_foliage).astype(np.uint8)
+    if img_src is None or donor_stats is None:
+        print("Ошибка загрузки изображений")
+        return
 
-    # 7. Сохранение
-    cv2.imwrite(output_path, final_image)
-    print(f"Изображение сохранено как {output_path}")
+    # 3. Перенос цвета по маске и наложение на исходник
+    final_image = transfer_foliage_by_strips(img_src, segmented, *donor_stats)
+
+    # 4. Сохранение
+    save_image(output_path, final_image)
 
 
 # Основной блок программы
 if __name__ == "__main__":
-    # Превращаем осень (Photo1) в лето -> Summer.jpg
-    transform_season('Photo1.jpg', 'Photo2.jpg', 'Summer.jpg',
-                     input_season='autumn', donor_season='summer')
+    # Каждое фото загружается один раз: оно исходник в одном направлении
+    # и донор в другом. Оба файла декодируются параллельно
+    with ThreadPoolExecutor(max_workers=2) as executor, \
+            ThreadPoolExecutor(max_workers=2) as write_executor:
+        photo1, photo2 = executor.map(cv2.imread, ['Photo1.jpg', 'Photo2.jpg'])  # осень, лето
+
+        if photo1 is None or photo2 is None:
+            print("Ошибка загрузки изображений")
+        else:
+            # Направления независимы, а почти все время уходит в OpenCV,
+            # который отпускает GIL - выполняем их параллельно
+            jobs = [
+                # Превращаем осень (Photo1) в лето -> Summer.jpg
+                (photo1, photo2, 'Summer.jpg', 'autumn', 'summer'),
+                # Превращаем лето (Photo2) в осень -> Autumn.jpg
+                (photo2, photo1, 'Autumn.jpg', 'summer', 'autumn'),
+            ]
+            # Кодирование и запись результата идут в отдельном пуле,
+            # не задерживая обработку второго направления
+            writes = list(executor.map(
+                lambda job: transform_season_images(*job, write_executor=write_executor), jobs))
 
-    # Превращаем лето (Photo2) в осень -> Autumn.jpg
-    transform_season('Photo2.jpg', 'Photo1.jpg', 'Autumn.jpg',
-                     input_season='summer', donor_season='autumn')
\ No newline at end of file
+            # Дожидаемся окончания записи (и ее ошибок) перед выходом
+            for write in writes:
+                write.result()